@@ -1,17 +1,56 @@
+import abc
+import argparse
+import contextlib
+import json
 import logging
+import random
 import smtplib
 import socket
 import ssl
+import struct
 import sys
 import threading
 import time
+import urllib.parse
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+import numpy as np
 import requests
 import yaml
 
 CONFIG_FILE = "./config.yaml"
 TEST_TEXT = "TESTE"
+DNS_RECORD_TYPES = {
+    "A": 1,
+    "NS": 2,
+    "CNAME": 5,
+    "MX": 15,
+    "TXT": 16,
+    "AAAA": 28
+}
+# probe type (the TYPE used on config file) -> probe class, filled by register_probe
+PROBE_TYPES = dict()
+# probe name -> True when the probe is failing, used by the status endpoint
+PROBE_FAILED = dict()
+# latencies are stored on log scale buckets: bucket b holds latencies up to LATENCY_MIN * LATENCY_GROWTH ** b
+# (1% resolution from 1us to ~20min), so percentiles are computed with bincount instead of sorting
+LATENCY_MIN = 1e-6
+LATENCY_GROWTH = 1.01
+LATENCY_BUCKETS = 2100
+SLO_DEFAULTS = {
+    "OBJECTIVE": 0.999,
+    "WINDOW": 2592000,
+    "PERCENTILES": [50, 90, 99],
+    "HISTORY_SIZE": 1000000,
+    # a rule only fires when its long window has MIN_SAMPLES probes and
+    # the probe history covers MIN_COVERAGE of it (avoid alerts right after the start)
+    "MIN_SAMPLES": 30,
+    "MIN_COVERAGE": 0.5,
+    "BURN_RATE_ALERTS": [
+        {"LONG_WINDOW": 3600, "SHORT_WINDOW": 300, "BURN_RATE": 14.4},
+        {"LONG_WINDOW": 21600, "SHORT_WINDOW": 1800, "BURN_RATE": 6}
+    ]
+}
 
 
 class TCPAuthenticationError(Exception):
@@ -30,6 +69,18 @@ class ErrorThresholdReached(Exception):
     pass
 
 
+class InvalidProbeConfig(Exception):
+    pass
+
+
+class InvalidDNSResponse(Exception):
+    pass
+
+
+class InvalidSLOConfig(Exception):
+    pass
+
+
 def write_http_response():
     """
     returns the text used on http endpoint.
@@ -38,15 +89,12 @@ def write_http_response():
     :return: bytes
     """
     text = list()
-    if HTTP_FAILED:
-        text.append("[ ] - HTTP OK")
-    else:
-        text.append("[X] - HTTP OK")
-
-    if TCP_FAILED:
-        text.append("[ ] - TCP OK")
-    else:
-        text.append("[X] - TCP OK")
+    # copy, the probe threads add new probes while iterating
+    for name, failed in list(PROBE_FAILED.items()):
+        if failed:
+            text.append("[ ] - {} OK".format(name))
+        else:
+            text.append("[X] - {} OK".format(name))
 
     return "\n".join(text).encode()
 
@@ -60,20 +108,23 @@ def read_config():
         return yaml.safe_load(cf)
 
 
-def tcp_connect():
+def tcp_connect(address=None, port=None, timeout=None):
     """
     connect at tcp service, auth and get the text on socket.
     if auth fail an error will be raised.
     we read 15 bytes (the size of string CLOUDWALK TESTE)
     if a timeout occurs, an empty text will be returned
+    :param address: string, defaults to TCP_SERVICE_ADDRESS
+    :param port: int, defaults to TCP_SERVICE_PORT
+    :param timeout: int, defaults to TIMEOUT
     :return: string
     """
 
     config = read_config()
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(config["TIMEOUT"])
+    s.settimeout(timeout or config["TIMEOUT"])
     try:
-        s.connect((config["TCP_SERVICE_ADDRESS"], config["TCP_SERVICE_PORT"]))
+        s.connect((address or config["TCP_SERVICE_ADDRESS"], port or config["TCP_SERVICE_PORT"]))
     except BaseException as connect_error:
         raise connect_error
     s.send("auth {}\n".format(config["TOKEN"]).encode())
@@ -133,11 +184,13 @@ def test_response(remote_message):
     return remote_message == "CLOUDWALK {}".format(TEST_TEXT)
 
 
-def http_connect():
+def http_connect(url=None, timeout=None):
     """
     make an http get on http service and parses the output
     if a timeout occurs, an empty text will be returned
     status codes != 200 will be considered an error
+    :param url: string, defaults to HTTP_SERVICE_ADDRESS
+    :param timeout: int, defaults to TIMEOUT
     :return: string
     """
     config = read_config()
@@ -146,7 +199,8 @@ def http_connect():
         "buf": TEST_TEXT
     }
     try:
-        r = requests.get(url=config["HTTP_SERVICE_ADDRESS"], params=params, timeout=config["TIMEOUT"])
+        r = requests.get(url=url or config["HTTP_SERVICE_ADDRESS"], params=params,
+                         timeout=timeout or config["TIMEOUT"])
     except requests.exceptions.ReadTimeout:
         log.error("http timeout")
         return ""
@@ -155,6 +209,705 @@ def http_connect():
     return r.text.strip()
 
 
+def build_dns_query(query_id, name, record_type="A"):
+    """
+    build a dns query packet (recursion desired) for the name and record type
+    :param query_id: int, id used to match the response
+    :param name: string
+    :param record_type: string, one of DNS_RECORD_TYPES
+    :return: bytes
+    """
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    question = b""
+    for label in name.rstrip(".").split("."):
+        label = label.encode()
+        question += struct.pack("!B", len(label)) + label
+    question += b"\x00" + struct.pack("!HH", DNS_RECORD_TYPES[record_type.upper()], 1)
+    return header + question
+
+
+def parse_dns_response(query_id, data):
+    """
+    parse the header of a dns response.
+    if the packet is not a response for query_id an error will be raised
+    :param query_id: int
+    :param data: bytes
+    :return: tuple (rcode, answers count, truncated)
+    """
+    if len(data) < 12:
+        raise InvalidDNSResponse("response too short: {} bytes".format(len(data)))
+    response_id, flags, _, answers, _, _ = struct.unpack("!HHHHHH", data[:12])
+    if response_id != query_id or not flags & 0x8000:
+        raise InvalidDNSResponse("unexpected response id: {}".format(response_id))
+    return flags & 0x000F, answers, bool(flags & 0x0200)
+
+
+def cert_days_left(cert, now=None):
+    """
+    returns how many days are left until the certificate expires
+    :param cert: dict, as returned by SSLSocket.getpeercert()
+    :param now: float, timestamp, defaults to now
+    :return: float
+    """
+    if now is None:
+        now = time.time()
+    return (ssl.cert_time_to_seconds(cert["notAfter"]) - now) / 86400
+
+
+def register_probe(kind):
+    """
+    class decorator to register a probe type, so it can be used on PROBES config
+    :param kind: string, the TYPE used on config file
+    :return: function
+    """
+    def wrapper(cls):
+        cls.kind = kind
+        PROBE_TYPES[kind] = cls
+        return cls
+    return wrapper
+
+
+class ProbeResult:
+    """
+    the result of a probe run, the same structure for all probe types.
+    timings holds the duration (seconds) of each probe phase (dns, connect, tls, request...)
+    and latency the duration of the whole run.
+    phases_ok holds the outcome of each phase: False only when the phase raised an error.
+    """
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.timestamp = time.time()
+        self.ok = False
+        self.latency = 0.0
+        self.timings = dict()
+        self.phases_ok = dict()
+        self.message = ""
+        self.details = dict()
+        self.error = None
+
+
+class Probe(abc.ABC):
+    """
+    base class of the probe types.
+    subclasses must implement check(result), returning True if the target is healthy.
+    errors raised by check() are stored on result.error.
+    """
+    kind = None
+    # options that must be supplied on config file
+    required = tuple()
+
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = options or dict()
+        missing = [key for key in self.required if key not in self.options]
+        if missing:
+            raise InvalidProbeConfig("probe {} missing options: {}".format(name, ", ".join(missing)))
+
+    def timeout(self):
+        """
+        the probe TIMEOUT option, defaults to global TIMEOUT
+        :return: int
+        """
+        return self.options.get("TIMEOUT", read_config()["TIMEOUT"])
+
+    def interval(self):
+        """
+        the probe CHECK_INTERVAL option, defaults to global CHECK_INTERVAL
+        :return: int
+        """
+        return self.options.get("CHECK_INTERVAL", read_config()["CHECK_INTERVAL"])
+
+    @contextlib.contextmanager
+    def phase(self, result, name):
+        """
+        measure the duration and the outcome of a probe phase
+        :param result: ProbeResult
+        :param name: string
+        :return: None
+        """
+        start = time.monotonic()
+        result.phases_ok[name] = False
+        try:
+            yield
+            result.phases_ok[name] = True
+        finally:
+            result.timings[name] = time.monotonic() - start
+
+    def resolve(self, result, address, port, kind=socket.SOCK_STREAM):
+        """
+        resolve the address, measured as dns phase
+        :return: tuple (family, type, proto, canonname, sockaddr)
+        """
+        with self.phase(result, "dns"):
+            return socket.getaddrinfo(address, port, socket.AF_UNSPEC, kind)[0]
+
+    @abc.abstractmethod
+    def check(self, result):
+        """
+        check the target, storing timings, message and details on result
+        :param result: ProbeResult
+        :return: bool, True if the target is healthy
+        """
+
+    def run(self):
+        """
+        run the probe once
+        :return: ProbeResult
+        """
+        result = ProbeResult(self.name, self.kind)
+        start = time.monotonic()
+        try:
+            result.ok = bool(self.check(result))
+        except Exception as probe_error:
+            result.error = probe_error
+            result.ok = False
+        result.latency = time.monotonic() - start
+        log.debug("{} ok: {} latency: {:.3f}s timings: {}".format(self.name, result.ok, result.latency,
+                                                                  result.timings))
+        return result
+
+
+@register_probe("tonto_tcp")
+class TontoTCPProbe(Probe):
+    """
+    the tonto tcp echo service (see tcp_connect).
+    ADDRESS and PORT default to TCP_SERVICE_ADDRESS and TCP_SERVICE_PORT
+    """
+    def check(self, result):
+        with self.phase(result, "request"):
+            result.message = tcp_connect(self.options.get("ADDRESS"), self.options.get("PORT"), self.timeout())
+        return test_response(result.message)
+
+
+@register_probe("tonto_http")
+class TontoHTTPProbe(Probe):
+    """
+    the tonto http echo service (see http_connect).
+    URL defaults to HTTP_SERVICE_ADDRESS
+    """
+    def check(self, result):
+        with self.phase(result, "request"):
+            result.message = http_connect(self.options.get("URL"), self.timeout())
+        return test_response(result.message)
+
+
+@register_probe("tcp")
+class TCPProbe(Probe):
+    """
+    plain tcp connect on ADDRESS:PORT
+    """
+    required = ("ADDRESS", "PORT")
+
+    def check(self, result):
+        family, kind, proto, _, sockaddr = self.resolve(result, self.options["ADDRESS"], self.options["PORT"])
+        with socket.socket(family, kind, proto) as s:
+            s.settimeout(self.timeout())
+            with self.phase(result, "connect"):
+                s.connect(sockaddr)
+        return True
+
+
+@register_probe("tls")
+class TLSProbe(Probe):
+    """
+    tls handshake on ADDRESS:PORT (default 443), validating the certificate.
+    the probe fails when the certificate expires in less than MIN_CERT_DAYS (default 14).
+    SERVER_NAME (sni) defaults to ADDRESS
+    """
+    required = ("ADDRESS",)
+
+    def check(self, result):
+        address = self.options["ADDRESS"]
+        family, kind, proto, _, sockaddr = self.resolve(result, address, self.options.get("PORT", 443))
+        ctx = ssl.create_default_context()
+        with socket.socket(family, kind, proto) as s:
+            s.settimeout(self.timeout())
+            with self.phase(result, "connect"):
+                s.connect(sockaddr)
+            with self.phase(result, "tls"):
+                tls = ctx.wrap_socket(s, server_hostname=self.options.get("SERVER_NAME", address))
+            with tls:
+                cert = tls.getpeercert()
+        days_left = cert_days_left(cert)
+        result.details["cert_days_left"] = days_left
+        result.message = "certificate expires in {:.1f} days".format(days_left)
+        if days_left < self.options.get("MIN_CERT_DAYS", 14):
+            log.error("{} {}".format(self.name, result.message))
+            return False
+        return True
+
+
+@register_probe("http")
+class HTTPProbe(Probe):
+    """
+    http request on URL, with METHOD (default GET), HEADERS and BODY.
+    the status code must be in EXPECTED_STATUS (default 200) and, if supplied,
+    EXPECTED_TEXT must be found on response body
+    """
+    required = ("URL",)
+
+    def check(self, result):
+        with self.phase(result, "request"):
+            r = requests.request(self.options.get("METHOD", "GET"), self.options["URL"],
+                                 headers=self.options.get("HEADERS"), data=self.options.get("BODY"),
+                                 timeout=self.timeout())
+        result.details["status_code"] = r.status_code
+        result.message = r.text.strip()
+        expected_status = self.options.get("EXPECTED_STATUS", [200])
+        if isinstance(expected_status, int):
+            expected_status = [expected_status]
+        if r.status_code not in expected_status:
+            log.error("{} returned status code: {}".format(self.name, r.status_code))
+            return False
+        return self.options.get("EXPECTED_TEXT", "") in r.text
+
+
+@register_probe("dns")
+class DNSProbe(Probe):
+    """
+    dns query over udp: asks SERVER:PORT (default 53) for QUERY with RECORD_TYPE (default A).
+    datagrams that are not the response of the query are discarded until the timeout.
+    the probe is ok when the server answers NOERROR with at least one record, truncated responses are failures
+    """
+    required = ("SERVER", "QUERY")
+
+    def __init__(self, name, options=None):
+        super().__init__(name, options)
+        if str(self.options.get("RECORD_TYPE", "A")).upper() not in DNS_RECORD_TYPES:
+            raise InvalidProbeConfig("probe {} unknown RECORD_TYPE: {}, accepted: {}".format(
+                name, self.options["RECORD_TYPE"], ", ".join(DNS_RECORD_TYPES)))
+
+    def check(self, result):
+        family, kind, proto, _, sockaddr = self.resolve(result, self.options["SERVER"],
+                                                        self.options.get("PORT", 53), socket.SOCK_DGRAM)
+        query_id = random.getrandbits(16)
+        query = build_dns_query(query_id, self.options["QUERY"], self.options.get("RECORD_TYPE", "A"))
+        with socket.socket(family, kind, proto) as s:
+            s.connect(sockaddr)
+            with self.phase(result, "query"):
+                deadline = time.monotonic() + self.timeout()
+                s.send(query)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise socket.timeout("no dns response for id {}".format(query_id))
+                    s.settimeout(remaining)
+                    data = s.recv(512)
+                    try:
+                        rcode, answers, truncated = parse_dns_response(query_id, data)
+                        break
+                    except InvalidDNSResponse as dns_error:
+                        log.debug("{} discarding datagram: {}".format(self.name, dns_error))
+        result.details["rcode"] = rcode
+        result.details["answers"] = answers
+        result.details["truncated"] = truncated
+        result.message = "rcode: {} answers: {} truncated: {}".format(rcode, answers, truncated)
+        return rcode == 0 and answers > 0 and not truncated
+
+
+@register_probe("tcp_ping")
+class TCPPingProbe(Probe):
+    """
+    latency ping without icmp: measures the tcp handshake (SYN -> SYN/ACK or RST) on ADDRESS:PORT (default 80).
+    a refused connection still means the host is alive, so it is counted as a reply.
+    COUNT (default 3) pings are sent, the probe fails when all of them are lost
+    """
+    required = ("ADDRESS",)
+
+    def __init__(self, name, options=None):
+        super().__init__(name, options)
+        if not isinstance(self.options.get("COUNT", 3), int) or self.options.get("COUNT", 3) < 1:
+            raise InvalidProbeConfig("probe {} COUNT must be at least 1".format(name))
+
+    def check(self, result):
+        family, kind, proto, _, sockaddr = self.resolve(result, self.options["ADDRESS"],
+                                                        self.options.get("PORT", 80))
+        count = self.options.get("COUNT", 3)
+        rtts = list()
+        for _ in range(count):
+            with socket.socket(family, kind, proto) as s:
+                s.settimeout(self.timeout())
+                start = time.monotonic()
+                try:
+                    s.connect(sockaddr)
+                except ConnectionRefusedError:
+                    pass
+                except OSError as ping_error:
+                    log.debug("{} ping lost: {}".format(self.name, ping_error))
+                    continue
+                rtts.append(time.monotonic() - start)
+        result.details["loss"] = 1 - len(rtts) / count
+        if not rtts:
+            result.message = "no reply"
+            return False
+        result.timings["rtt"] = sum(rtts) / len(rtts)
+        result.details["rtt_min"] = min(rtts)
+        result.details["rtt_max"] = max(rtts)
+        result.message = "rtt min/avg/max: {:.3f}/{:.3f}/{:.3f}s".format(min(rtts), result.timings["rtt"], max(rtts))
+        return True
+
+
+def load_probes(config):
+    """
+    build the probes listed on PROBES config, the NAME must be unique.
+    if PROBES is not supplied, the tonto http and tcp probes are used
+    :param config: dict
+    :return: list
+    """
+    if "PROBES" not in config:
+        return [TontoHTTPProbe("HTTP"), TontoTCPProbe("TCP")]
+    probes = list()
+    for options in config["PROBES"]:
+        if options.get("TYPE") not in PROBE_TYPES:
+            raise InvalidProbeConfig("unknown probe type: {}".format(options.get("TYPE")))
+        if "NAME" not in options:
+            raise InvalidProbeConfig("probe without NAME: {}".format(options))
+        if options["NAME"] in [probe.name for probe in probes]:
+            raise InvalidProbeConfig("duplicated probe NAME: {}".format(options["NAME"]))
+        probes.append(PROBE_TYPES[options["TYPE"]](options["NAME"], options))
+    return probes
+
+
+class ProbeHistory:
+    """
+    ring buffer with the probe results, stored on numpy arrays so the slo report
+    is computed over all rows at once.
+    each result is stored as one row per phase, plus a "total" row with the whole probe latency.
+    latencies are stored as the LATENCY_BUCKETS bucket index.
+    """
+    def __init__(self, size=1000000):
+        self.size = size
+        self.timestamp = np.zeros(size, dtype=np.float64)
+        self.target = np.zeros(size, dtype=np.int32)
+        self.phase = np.zeros(size, dtype=np.int32)
+        self.ok = np.zeros(size, dtype=bool)
+        self.latency = np.zeros(size, dtype=np.int16)
+        # newest timestamp stored until each row, sorted on insertion order,
+        # so the rows of a window are found with a binary search
+        self.newest = np.zeros(size, dtype=np.float64)
+        # index -> name of targets (probes) and phases
+        self.targets = list()
+        self.phases = ["total"]
+        # rows written since the start, the buffer holds the last `size` rows
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def index(names, name):
+        """
+        returns the index of name, adding it when not found
+        :param names: list
+        :param name: string
+        :return: int
+        """
+        try:
+            return names.index(name)
+        except ValueError:
+            names.append(name)
+            return len(names) - 1
+
+    def append(self, result):
+        """
+        store a probe result, the "total" row with the probe outcome and
+        each phase row with the phase outcome (ok when not in phases_ok)
+        :param result: ProbeResult
+        :return: None
+        """
+        self.extend([result.name] * (len(result.timings) + 1),
+                    ["total"] + list(result.timings),
+                    [result.timestamp] * (len(result.timings) + 1),
+                    [result.ok] + [result.phases_ok.get(phase, True) for phase in result.timings],
+                    [result.latency] + list(result.timings.values()))
+
+    def extend(self, targets, phases, timestamp, ok, latency):
+        """
+        store a batch of rows, all arguments are sequences with the same size
+        :param targets: target (probe) names
+        :param phases: phase names
+        :param timestamp: floats
+        :param ok: bools
+        :param latency: floats, seconds
+        :return: None
+        """
+        target_names, target = np.unique(np.asarray(targets), return_inverse=True)
+        phase_names, phase = np.unique(np.asarray(phases), return_inverse=True)
+        rows = slice(-self.size, None)
+        with self.lock:
+            target = np.array([self.index(self.targets, name) for name in target_names.tolist()],
+                              dtype=np.int32)[target]
+            phase = np.array([self.index(self.phases, name) for name in phase_names.tolist()],
+                             dtype=np.int32)[phase]
+            positions = (self.count + np.arange(len(target))) % self.size
+            positions = positions[rows]
+            timestamp = np.asarray(timestamp, dtype=np.float64)
+            newest = self.newest[(self.count - 1) % self.size] if self.count else -np.inf
+            self.newest[positions] = np.maximum.accumulate(np.maximum(timestamp, newest))[rows]
+            self.timestamp[positions] = timestamp[rows]
+            self.target[positions] = target[rows]
+            self.phase[positions] = phase[rows]
+            self.ok[positions] = np.asarray(ok, dtype=bool)[rows]
+            self.latency[positions] = latency_bucket(np.asarray(latency, dtype=np.float64)[rows])
+            self.count += len(target)
+
+    def snapshot(self, since=None):
+        """
+        copy of the rows stored, safe to use while probes are running.
+        with since, only the rows stored after the first row with timestamp >= since are copied,
+        so the cost depends on the window and not on the buffer size.
+        truncated is True when rows after since were already overwritten
+        :param since: float, timestamp
+        :return: dict
+        """
+        with self.lock:
+            # older and newer part of the ring buffer, each sorted on insertion order
+            start = self.count % self.size if self.count > self.size else 0
+            parts = [slice(start, min(self.count, self.size)), slice(0, start)]
+            if since is not None:
+                first = start + np.searchsorted(self.newest[parts[0]], since)
+                if first < parts[0].stop:
+                    parts[0] = slice(first, parts[0].stop)
+                else:
+                    parts = [slice(np.searchsorted(self.newest[parts[1]], since), start)]
+            return {
+                "targets": list(self.targets),
+                "phases": list(self.phases),
+                "truncated": bool(self.count > self.size and (since is None or self.newest[start] > since)),
+                "timestamp": np.concatenate([self.timestamp[part] for part in parts]),
+                "target": np.concatenate([self.target[part] for part in parts]),
+                "phase": np.concatenate([self.phase[part] for part in parts]),
+                "ok": np.concatenate([self.ok[part] for part in parts]),
+                "latency": np.concatenate([self.latency[part] for part in parts])
+            }
+
+
+def slo_config(config):
+    """
+    the SLO config merged with the defaults.
+    if OBJECTIVE is not between 0 and 1, a percentile is not between 0 and 100,
+    MIN_SAMPLES/MIN_COVERAGE are out of range or a BURN_RATE_ALERTS rule is invalid an error will be raised
+    :param config: dict
+    :return: dict
+    """
+    slo = dict(SLO_DEFAULTS, **(config.get("SLO") or dict()))
+    if not 0 < slo["OBJECTIVE"] < 1:
+        raise InvalidSLOConfig("OBJECTIVE must be between 0 and 1 (exclusive): {}".format(slo["OBJECTIVE"]))
+    for q in slo["PERCENTILES"]:
+        if not 0 <= q <= 100:
+            raise InvalidSLOConfig("PERCENTILES must be between 0 and 100: {}".format(q))
+    if isinstance(slo["MIN_SAMPLES"], bool) or not isinstance(slo["MIN_SAMPLES"], int) or slo["MIN_SAMPLES"] < 1:
+        raise InvalidSLOConfig("MIN_SAMPLES must be at least 1: {}".format(slo["MIN_SAMPLES"]))
+    if not 0 <= slo["MIN_COVERAGE"] <= 1:
+        raise InvalidSLOConfig("MIN_COVERAGE must be between 0 and 1: {}".format(slo["MIN_COVERAGE"]))
+    if not slo["BURN_RATE_ALERTS"]:
+        raise InvalidSLOConfig("BURN_RATE_ALERTS must have at least one rule")
+    for rule in slo["BURN_RATE_ALERTS"]:
+        for key in ("LONG_WINDOW", "SHORT_WINDOW", "BURN_RATE"):
+            value = rule.get(key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise InvalidSLOConfig("BURN_RATE_ALERTS {} must be a positive number: {}".format(key, rule))
+        if rule["SHORT_WINDOW"] > rule["LONG_WINDOW"]:
+            raise InvalidSLOConfig("BURN_RATE_ALERTS SHORT_WINDOW must be <= LONG_WINDOW: {}".format(rule))
+    return slo
+
+
+def latency_bucket(latency):
+    """
+    the LATENCY_BUCKETS bucket of each latency
+    :param latency: numpy array, seconds
+    :return: numpy array
+    """
+    bucket = np.ceil(np.log(np.maximum(latency, LATENCY_MIN) / LATENCY_MIN) / np.log(LATENCY_GROWTH))
+    return np.clip(bucket, 0, LATENCY_BUCKETS - 1).astype(np.int16)
+
+
+def latency_percentiles(histogram, percentiles):
+    """
+    latency percentiles (nearest rank) of each group, as the upper bound of the percentile bucket.
+    groups without rows will be nan
+    :param histogram: numpy array (groups x LATENCY_BUCKETS), rows count of each latency bucket
+    :param percentiles: list of percentiles (0-100)
+    :return: numpy array (groups x percentiles), seconds
+    """
+    cumulative = np.cumsum(histogram, axis=1)
+    count = cumulative[:, -1]
+    result = np.full((len(histogram), len(percentiles)), np.nan)
+    found = count > 0
+    for i, q in enumerate(percentiles):
+        rank = np.maximum(np.ceil(count[found] * q / 100.0), 1)
+        index = (cumulative[found] < rank[:, None]).sum(axis=1)
+        result[found, i] = LATENCY_MIN * LATENCY_GROWTH ** index
+    return result
+
+
+def burn_rates(history, objective, windows, now=None):
+    """
+    error budget burn rate of each target over each window, using the "total" phase rows
+    :param history: ProbeHistory
+    :param objective: float, availability objective (0.999)
+    :param windows: list of windows, seconds
+    :param now: float, timestamp, defaults to now
+    :return: tuple (target names, burn rates, samples, seconds covered), numpy arrays targets x windows
+    """
+    if now is None:
+        now = time.time()
+    data = history.snapshot(now - max(windows))
+    targets = len(data["targets"])
+    order = np.argsort(windows)
+    sorted_windows = np.asarray(windows, dtype=np.float64)[order]
+    # slot of each row: index of the smallest window holding it, len(windows) when out of all windows
+    slot = np.searchsorted(sorted_windows, now - data["timestamp"])
+    slot[data["phase"] != 0] = len(windows)
+    key = (data["target"].astype(np.int64) * 2 + ~data["ok"]) * (len(windows) + 1) + slot
+    histogram = np.bincount(key, minlength=targets * 2 * (len(windows) + 1))
+    # a row in a window is also in all bigger windows
+    cumulative = np.cumsum(histogram.reshape(targets, 2, len(windows) + 1)[:, :, :-1], axis=2)
+    rates = np.empty((targets, len(windows)))
+    samples = np.empty((targets, len(windows)), dtype=np.int64)
+    samples[:, order] = cumulative.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates[:, order] = cumulative[:, 1] / samples[:, order] / (1 - objective)
+    # oldest "total" row of each target in the biggest window, a window is covered since it
+    total = slot < len(windows)
+    oldest = np.full(targets, now)
+    np.minimum.at(oldest, data["target"][total], data["timestamp"][total])
+    covered = np.minimum(np.asarray(windows, dtype=np.float64), (now - oldest)[:, None])
+    return data["targets"], rates, samples, covered
+
+
+def burn_rate_alert(history, name, slo, now=None):
+    """
+    multi-window burn rate alert: fires when the burn rate of the long and the short window
+    of any BURN_RATE_ALERTS rule reach the rule BURN_RATE.
+    a rule does not fire before its long window has MIN_SAMPLES probes and MIN_COVERAGE of it is covered
+    :param history: ProbeHistory
+    :param name: string, target name
+    :param slo: dict, see slo_config
+    :param now: float, timestamp, defaults to now
+    :return: bool
+    """
+    rules = slo["BURN_RATE_ALERTS"]
+    windows = list()
+    for rule in rules:
+        windows += [rule["LONG_WINDOW"], rule["SHORT_WINDOW"]]
+    targets, rates, samples, covered = burn_rates(history, slo["OBJECTIVE"], windows, now)
+    if name not in targets:
+        return False
+    rates = rates[targets.index(name)]
+    samples = samples[targets.index(name)]
+    covered = covered[targets.index(name)]
+    for i, rule in enumerate(rules):
+        if samples[2 * i] < slo["MIN_SAMPLES"] or covered[2 * i] < slo["MIN_COVERAGE"] * rule["LONG_WINDOW"]:
+            log.debug("{} not enough data for {}s window: {} probes, {:.0f}s covered".format(
+                name, rule["LONG_WINDOW"], samples[2 * i], covered[2 * i]))
+            continue
+        if rates[2 * i] >= rule["BURN_RATE"] and rates[2 * i + 1] >= rule["BURN_RATE"]:
+            log.error("{} burn rate {:.1f} (last {}s) and {:.1f} (last {}s) reached {}".format(
+                name, rates[2 * i], rule["LONG_WINDOW"], rates[2 * i + 1], rule["SHORT_WINDOW"], rule["BURN_RATE"]))
+            return True
+    return False
+
+
+def json_number(value):
+    """
+    converts numpy numbers to float, nan to None
+    :param value: number
+    :return: float or None
+    """
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return value
+
+
+def slo_report(history, slo, now=None, window=None):
+    """
+    availability, error budget and latency percentiles of each target and phase over the window.
+    latency percentiles only consider successful probes.
+    the history may not cover the whole window (recent start or rows overwritten), so the report
+    has the oldest timestamp used and the seconds covered.
+    :param history: ProbeHistory
+    :param slo: dict, see slo_config
+    :param now: float, timestamp, defaults to now
+    :param window: int, seconds, defaults to SLO WINDOW
+    :return: dict
+    """
+    if now is None:
+        now = time.time()
+    if window is None:
+        window = slo["WINDOW"]
+    data = history.snapshot(now - window)
+    phases = len(data["phases"])
+    groups = len(data["targets"]) * phases
+    # one histogram of (target, phase, ok, latency bucket), rows out of the window go to the last bin
+    key = ((data["target"].astype(np.int64) * phases + data["phase"]) * 2 + data["ok"]) * LATENCY_BUCKETS
+    key += data["latency"]
+    in_window = data["timestamp"] >= now - window
+    key[~in_window] = groups * 2 * LATENCY_BUCKETS
+    oldest = data["timestamp"].min(where=in_window, initial=np.inf)
+    if data["truncated"]:
+        log.warning("history covers only {:.0f}s of the {}s window, increase HISTORY_SIZE".format(now - oldest,
+                                                                                                 window))
+    histogram = np.bincount(key, minlength=groups * 2 * LATENCY_BUCKETS + 1)[:-1]
+    histogram = histogram.reshape(groups, 2, LATENCY_BUCKETS)
+    good = histogram[:, 1].sum(axis=1)
+    count = good + histogram[:, 0].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        availability = good / count
+    burn_rate = (1 - availability) / (1 - slo["OBJECTIVE"])
+    latency = latency_percentiles(histogram[:, 1], slo["PERCENTILES"])
+
+    report = {
+        "objective": slo["OBJECTIVE"],
+        "window": window,
+        "oldest": json_number(oldest) if np.isfinite(oldest) else None,
+        "covered": json_number(now - oldest) if np.isfinite(oldest) else 0,
+        "truncated": data["truncated"],
+        "percentiles": slo["PERCENTILES"],
+        "targets": dict()
+    }
+    for target, target_name in enumerate(data["targets"]):
+        for phase, phase_name in enumerate(data["phases"]):
+            group = target * phases + phase
+            if not count[group]:
+                continue
+            report["targets"].setdefault(target_name, dict())[phase_name] = {
+                "count": int(count[group]),
+                "availability": json_number(availability[group]),
+                "burn_rate": json_number(burn_rate[group]),
+                "error_budget_remaining": json_number(1 - burn_rate[group]),
+                "latency": [json_number(value) for value in latency[group]]
+            }
+    return report
+
+
+def format_slo_report(report):
+    """
+    the slo report as a text table, latencies in ms
+    :param report: dict, see slo_report
+    :return: string
+    """
+    header = ["TARGET", "PHASE", "COUNT", "AVAILABILITY", "BURN RATE", "BUDGET LEFT"]
+    header += ["P{}".format(q) for q in report["percentiles"]]
+    rows = [header]
+    for target_name, phases in report["targets"].items():
+        for phase_name, metrics in phases.items():
+            row = [target_name, phase_name, str(metrics["count"]),
+                   "{:.4%}".format(metrics["availability"]),
+                   "{:.2f}".format(metrics["burn_rate"]),
+                   "{:.2%}".format(metrics["error_budget_remaining"])]
+            row += ["-" if value is None else "{:.1f}ms".format(value * 1000) for value in metrics["latency"]]
+            rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    text = ["objective: {:.3%} window: {}s covered: {:.0f}s".format(report["objective"], report["window"],
+                                                                    report["covered"])]
+    if report["truncated"]:
+        text.append("history truncated, increase HISTORY_SIZE")
+    for row in rows:
+        text.append("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    return "\n".join(text)
+
+
 class Healthy:
     """
     this class helps to determine if a service is healthy or not
@@ -234,14 +987,16 @@ class Healthy:
         self.err_counter = 0
 
 
-def wait_interval():
+def wait_interval(interval=None):
     """
     sleep for X times
+    :param interval: int, defaults to CHECK_INTERVAL
     :return:
     """
-    config = read_config()
-    log.debug("Sleeping for: {}s".format(config["CHECK_INTERVAL"]))
-    time.sleep(config["CHECK_INTERVAL"])
+    if interval is None:
+        interval = read_config()["CHECK_INTERVAL"]
+    log.debug("Sleeping for: {}s".format(interval))
+    time.sleep(interval)
 
 
 class Tests:
@@ -251,77 +1006,71 @@ class Tests:
     # variable used only for tests purposes
     _RUNNING = True
 
-    def test_tcp(self):
+    def run_probe(self, probe):
         """
-        make the dirty job to test the returned messages from tcp socket.
-        it will check if the response was ok or not.
+        run a probe in loop, alerting by error budget burn rate when SLO is configured,
+        otherwise by HEALTHY_THRESHOLD/UNHEALTHY_THRESHOLD
+        :param probe: Probe
         :return: None
         """
-        global TCP_FAILED
-        h = Healthy()
-        last_ok = False
+        if "SLO" in read_config():
+            self.watch_burn_rate(probe)
+        else:
+            self.watch_thresholds(probe)
+
+    def watch_burn_rate(self, probe):
+        """
+        run a probe in loop, storing the results on HISTORY.
+        notify when the burn rate alert starts or stops firing.
+        :param probe: Probe
+        :return: None
+        """
+        alerting = False
         while self._RUNNING:
             try:
-                if test_response(tcp_connect()):
-                    log.debug("test response OK")
-                    h.success()
-                    if last_ok is False and h.ok is True:
-                        log.debug("tcp service recovered")
-                        notify("TCP OK")
-                        TCP_FAILED = False
-                        h.enable_notify()
-                    last_ok = h.ok
-                    h.error_reset()
-                    wait_interval()
-                else:
-                    log.debug("wrong response")
-                    try:
-                        h.error()
-                    except ErrorThresholdReached:
-                        log.error("too many wrong remote responses")
-                        if h.notify:
-                            notify("TCP Error - too many wrong remote responses")
-                            h.still_notified()
-                        TCP_FAILED = True
-                        h.reset_all()
-                    if last_ok is False and h.ok is False:
-                        log.debug("http service changed to false")
-                        if h.notify:
-                            notify("TCP Error")
-                            h.still_notified()
-                        # global TCP_FAILED
-                        TCP_FAILED = True
-                        h.reset_all()
-                    last_ok = False
-                    wait_interval()
-            except BaseException as general_error:
-                h.reset_all()
-                log.error(general_error)
-                TCP_FAILED = True
-                wait_interval()
+                result = probe.run()
+                HISTORY.append(result)
+                if result.error is not None:
+                    log.error(result.error)
+                firing = burn_rate_alert(HISTORY, probe.name, slo_config(read_config()))
+                if firing and not alerting:
+                    notify("{} Error - error budget burn rate too high".format(probe.name))
+                elif alerting and not firing:
+                    log.debug("{} service recovered".format(probe.name))
+                    notify("{} OK".format(probe.name))
+                alerting = firing
+                PROBE_FAILED[probe.name] = firing
+            except BaseException as probe_error:
+                log.error(probe_error)
+                PROBE_FAILED[probe.name] = True
+            wait_interval(probe.interval())
 
-    def test_http(self):
+    def watch_thresholds(self, probe):
         """
-        make the dirty job to test the returned messages from http get.
-        it will check if the response was ok or not.
+        make the dirty job to run a probe in loop.
+        it will check if the probe result was ok or not, and notify the state changes.
+        :param probe: Probe
         :return: None
         """
         h = Healthy()
         last_ok = False
-        global HTTP_FAILED
         while self._RUNNING:
             try:
-                if test_response(http_connect()):
+                result = probe.run()
+                HISTORY.append(result)
+                if result.error is not None:
+                    raise result.error
+                if result.ok:
                     log.debug("test response OK")
                     h.success()
                     if last_ok is False and h.ok is True:
-                        log.debug("http service recovered")
-                        notify("HTTP OK")
+                        log.debug("{} service recovered".format(probe.name))
+                        notify("{} OK".format(probe.name))
+                        PROBE_FAILED[probe.name] = False
                         h.enable_notify()
-                        HTTP_FAILED = False
                     last_ok = h.ok
                     h.error_reset()
-                    wait_interval()
+                    wait_interval(probe.interval())
                 else:
                     log.debug("wrong response")
                     try:
@@ -329,24 +1078,38 @@ class Tests:
                     except ErrorThresholdReached:
                         log.error("too many wrong remote responses")
                         if h.notify:
-                            notify("HTTP Error - too many wrong remote responses")
+                            notify("{} Error - too many wrong remote responses".format(probe.name))
                             h.still_notified()
-                        HTTP_FAILED = True
+                        PROBE_FAILED[probe.name] = True
                         h.reset_all()
                     if last_ok is False and h.ok is False:
-                        log.debug("http service changed to false")
+                        log.debug("{} service changed to false".format(probe.name))
                         if h.notify:
-                            notify("HTTP Error")
+                            notify("{} Error".format(probe.name))
                             h.still_notified()
-                        HTTP_FAILED = True
+                        PROBE_FAILED[probe.name] = True
                         h.reset_all()
                     last_ok = False
-                    wait_interval()
-            except BaseException as e:
+                    wait_interval(probe.interval())
+            except BaseException as probe_error:
                 h.reset_all()
-                log.error(e)
-                HTTP_FAILED = True
-                wait_interval()
+                log.error(probe_error)
+                PROBE_FAILED[probe.name] = True
+                wait_interval(probe.interval())
+
+    def test_tcp(self):
+        """
+        run the tonto tcp probe
+        :return: None
+        """
+        self.run_probe(TontoTCPProbe("TCP"))
+
+    def test_http(self):
+        """
+        run the tonto http probe
+        :return: None
+        """
+        self.run_probe(TontoHTTPProbe("HTTP"))
 
 
 class StatusHTTPServer(BaseHTTPRequestHandler):
@@ -356,14 +1119,26 @@ class StatusHTTPServer(BaseHTTPRequestHandler):
     def do_GET(self):
         """
         handler to manage get requests
+        /slo returns the slo report as json, the window (seconds) can be changed with ?window=
         :return:
         """
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/slo":
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                window = int(query["window"][0]) if "window" in query else None
+            except ValueError:
+                self.send_error(400, "invalid window")
+                return
+            report = slo_report(HISTORY, slo_config(read_config()), window=window)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(report).encode())
+            return
         self.send_response(200)
         self.end_headers()
-        try:
-            response = write_http_response()
-        except NameError:
-            response = b"please wait"
+        response = write_http_response() or b"please wait"
         self.wfile.write(response)
 
 
@@ -373,10 +1148,11 @@ def start_threads():
     :return:
     """
     t = Tests()
-    t1 = threading.Thread(target=t.test_http)
-    t2 = threading.Thread(target=t.test_tcp)
-    t1.start()
-    t2.start()
+    threads = list()
+    for probe in load_probes(read_config()):
+        thread = threading.Thread(target=t.run_probe, args=(probe,), name=probe.name)
+        thread.start()
+        threads.append(thread)
 
     h = HTTPServer(('0.0.0.0', 8080), StatusHTTPServer, False)
     h.server_bind()
@@ -389,8 +1165,36 @@ def start_threads():
     t3 = threading.Thread(target=serve_forever, args=(h,))
     t3.setDaemon(True)
     t3.start()
-    t1.join()
-    t2.join()
+    for thread in threads:
+        thread.join()
+
+
+def slo_command(url, window=None):
+    """
+    print the slo report of a running checker
+    :param url: string, the /slo endpoint of status server
+    :param window: int, seconds, defaults to SLO WINDOW
+    :return: None
+    """
+    params = {"window": window} if window else None
+    r = requests.get(url, params=params, timeout=read_config()["TIMEOUT"])
+    r.raise_for_status()
+    print(format_slo_report(r.json()))
+
+
+def parse_args(args=None):
+    """
+    parse the command line arguments
+    :param args: list, defaults to sys.argv
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="monitoring of tonto services")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("run", help="run the probes and the status server (default)")
+    slo = subparsers.add_parser("slo", help="print the slo report of a running checker")
+    slo.add_argument("--url", default="http://127.0.0.1:8080/slo", help="status server slo endpoint")
+    slo.add_argument("--window", type=int, help="window in seconds, defaults to SLO WINDOW")
+    return parser.parse_args(args)
 
 
 # logger format
@@ -416,5 +1220,15 @@ try:
 except KeyError:
     logging.basicConfig(level=logging.CRITICAL, format=log_format)
 
+try:
+    HISTORY = ProbeHistory(slo_config(CONFIG)["HISTORY_SIZE"])
+except InvalidSLOConfig as err:
+    log.error(err)
+    sys.exit(1)
+
 if __name__ == '__main__':
-    start_threads()
+    arguments = parse_args()
+    if arguments.command == "slo":
+        slo_command(arguments.url, arguments.window)
+    else:
+        start_threads()
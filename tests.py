@@ -1,5 +1,8 @@
+import socket
+import threading
 import unittest
 
+import numpy as np
 import requests
 import requests_mock
 
@@ -261,3 +264,367 @@ class TestHTTPService(unittest.TestCase):
                                                              True,
                                                              False])
         self.assertIsNone(scan.test_http())
+
+
+class TestLoadProbes(unittest.TestCase):
+    def test_default_probes(self):
+        main.CONFIG_FILE = "./tests/config-tests.yaml"
+        probes = main.load_probes(main.read_config())
+        self.assertEqual(["HTTP", "TCP"], [probe.name for probe in probes])
+        self.assertIsInstance(probes[0], main.TontoHTTPProbe)
+        self.assertIsInstance(probes[1], main.TontoTCPProbe)
+
+    def test_config_probes(self):
+        probes = main.load_probes({"PROBES": [{"NAME": "web", "TYPE": "http", "URL": "http://127.0.0.2"},
+                                              {"NAME": "ns", "TYPE": "dns", "SERVER": "127.0.0.1",
+                                               "QUERY": "example.com"}]})
+        self.assertIsInstance(probes[0], main.HTTPProbe)
+        self.assertIsInstance(probes[1], main.DNSProbe)
+
+    def test_unknown_type(self):
+        self.assertRaises(main.InvalidProbeConfig, main.load_probes, {"PROBES": [{"NAME": "x", "TYPE": "gopher"}]})
+
+    def test_missing_options(self):
+        self.assertRaises(main.InvalidProbeConfig, main.load_probes, {"PROBES": [{"NAME": "x", "TYPE": "tcp"}]})
+        self.assertRaises(main.InvalidProbeConfig, main.load_probes, {"PROBES": [{"TYPE": "http", "URL": "x"}]})
+
+    def test_tcp_ping_count(self):
+        self.assertRaises(main.InvalidProbeConfig, main.TCPPingProbe, "ping", {"ADDRESS": "127.0.0.1", "COUNT": 0})
+
+    def test_dns_record_type(self):
+        self.assertRaises(main.InvalidProbeConfig, main.DNSProbe, "ns",
+                          {"SERVER": "127.0.0.1", "QUERY": "example.com", "RECORD_TYPE": "SRV"})
+        self.assertIsNotNone(main.DNSProbe("ns", {"SERVER": "127.0.0.1", "QUERY": "example.com",
+                                                  "RECORD_TYPE": "aaaa"}))
+
+    def test_probe_without_check(self):
+        @main.register_probe("broken")
+        class BrokenProbe(main.Probe):
+            pass
+
+        try:
+            self.assertRaises(TypeError, main.load_probes, {"PROBES": [{"NAME": "x", "TYPE": "broken"}]})
+        finally:
+            del main.PROBE_TYPES["broken"]
+
+    def test_duplicated_name(self):
+        self.assertRaises(main.InvalidProbeConfig, main.load_probes,
+                          {"PROBES": [{"NAME": "web", "TYPE": "http", "URL": "http://127.0.0.2"},
+                                      {"NAME": "web", "TYPE": "tcp", "ADDRESS": "127.0.0.1", "PORT": 80}]})
+
+
+class TestProbes(unittest.TestCase):
+    def setUp(self):
+        main.CONFIG_FILE = "./tests/config-tests.yaml"
+
+    @mock.patch('main.http_connect')
+    @mock.patch('main.tcp_connect')
+    def test_tonto_timeout(self, mock_tcp_connect, mock_http_connect):
+        mock_tcp_connect.return_value = "CLOUDWALK TESTE"
+        mock_http_connect.return_value = "CLOUDWALK TESTE"
+        self.assertTrue(main.TontoTCPProbe("TCP", {"TIMEOUT": 3}).run().ok)
+        mock_tcp_connect.assert_called_once_with(None, None, 3)
+        self.assertTrue(main.TontoHTTPProbe("HTTP").run().ok)
+        mock_http_connect.assert_called_once_with(None, 10)
+
+    def test_tcp_ok(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.bind(("127.0.0.1", 0))
+            server.listen(1)
+            probe = main.TCPProbe("tcp", {"ADDRESS": "127.0.0.1", "PORT": server.getsockname()[1]})
+            result = probe.run()
+        self.assertTrue(result.ok)
+        self.assertIsNone(result.error)
+        self.assertIn("dns", result.timings)
+        self.assertIn("connect", result.timings)
+
+    def test_tcp_refused(self):
+        result = main.TCPProbe("tcp", {"ADDRESS": "127.0.0.1", "PORT": 3000}).run()
+        self.assertFalse(result.ok)
+        self.assertIsInstance(result.error, ConnectionRefusedError)
+
+    def test_tcp_ping_refused_is_a_reply(self):
+        result = main.TCPPingProbe("ping", {"ADDRESS": "127.0.0.1", "PORT": 3000, "COUNT": 2}).run()
+        self.assertTrue(result.ok)
+        self.assertEqual(0, result.details["loss"])
+        self.assertIn("rtt", result.timings)
+
+    @requests_mock.Mocker()
+    def test_http_method_headers_body(self, request_mock):
+        request_mock.post("http://127.0.0.2/health", status_code=201, text="healthy")
+        probe = main.HTTPProbe("web", {"URL": "http://127.0.0.2/health", "METHOD": "POST",
+                                       "HEADERS": {"X-Token": "abc"}, "BODY": "ping",
+                                       "EXPECTED_STATUS": [200, 201], "EXPECTED_TEXT": "healthy"})
+        result = probe.run()
+        self.assertTrue(result.ok)
+        self.assertEqual(201, result.details["status_code"])
+        self.assertEqual("abc", request_mock.last_request.headers["X-Token"])
+        self.assertEqual("ping", request_mock.last_request.text)
+
+    @requests_mock.Mocker()
+    def test_http_unexpected_status(self, request_mock):
+        request_mock.get("http://127.0.0.2", status_code=500)
+        self.assertFalse(main.HTTPProbe("web", {"URL": "http://127.0.0.2"}).run().ok)
+
+    def test_dns(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(("127.0.0.1", 0))
+
+            def answer():
+                data, address = server.recvfrom(512)
+                # stray datagrams: too short and a late response with another id
+                server.sendto(b"\x00", address)
+                server.sendto(bytes([data[0] ^ 0xff, data[1]]) + b"\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00",
+                              address)
+                # same id and question, flags: response + recursion available, one answer
+                server.sendto(data[:2] + b"\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00" + data[12:], address)
+
+            t = threading.Thread(target=answer)
+            t.start()
+            probe = main.DNSProbe("ns", {"SERVER": "127.0.0.1", "PORT": server.getsockname()[1],
+                                         "QUERY": "example.com"})
+            result = probe.run()
+            t.join()
+        self.assertTrue(result.ok)
+        self.assertEqual(1, result.details["answers"])
+        self.assertIn("query", result.timings)
+
+    def test_dns_truncated(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(("127.0.0.1", 0))
+
+            def answer():
+                data, address = server.recvfrom(512)
+                # flags: response + truncated
+                server.sendto(data[:2] + b"\x82\x80\x00\x01\x00\x01\x00\x00\x00\x00" + data[12:], address)
+
+            t = threading.Thread(target=answer)
+            t.start()
+            probe = main.DNSProbe("ns", {"SERVER": "127.0.0.1", "PORT": server.getsockname()[1],
+                                         "QUERY": "example.com"})
+            result = probe.run()
+            t.join()
+        self.assertFalse(result.ok)
+        self.assertTrue(result.details["truncated"])
+
+    def test_dns_timeout(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(("127.0.0.1", 0))
+            probe = main.DNSProbe("ns", {"SERVER": "127.0.0.1", "PORT": server.getsockname()[1],
+                                         "QUERY": "example.com", "TIMEOUT": 0.2})
+            result = probe.run()
+        self.assertFalse(result.ok)
+        self.assertIsInstance(result.error, socket.timeout)
+
+    def test_dns_query(self):
+        query = main.build_dns_query(4660, "example.com.", "aaaa")
+        self.assertEqual(b"\x12\x34\x01\x00\x00\x01", query[:6])
+        self.assertEqual(b"\x07example\x03com\x00\x00\x1c\x00\x01", query[12:])
+        self.assertRaises(main.InvalidDNSResponse, main.parse_dns_response, 4660, query)
+        self.assertRaises(main.InvalidDNSResponse, main.parse_dns_response, 4660, b"\x12")
+
+    def test_cert_days_left(self):
+        cert = {"notAfter": "Jan  5 00:00:00 2022 GMT"}
+        now = main.ssl.cert_time_to_seconds("Jan  1 00:00:00 2022 GMT")
+        self.assertEqual(4, main.cert_days_left(cert, now))
+
+
+class TestStatusResponse(unittest.TestCase):
+    def test_write_http_response(self):
+        main.PROBE_FAILED.clear()
+        self.assertEqual(b"", main.write_http_response())
+        main.PROBE_FAILED["HTTP"] = True
+        main.PROBE_FAILED["TCP"] = False
+        self.assertEqual(b"[ ] - HTTP OK\n[X] - TCP OK", main.write_http_response())
+        main.PROBE_FAILED.clear()
+
+
+class TestProbeHistory(unittest.TestCase):
+    def test_append(self):
+        h = main.ProbeHistory(10)
+        result = main.ProbeResult("web", "http")
+        result.ok = True
+        result.latency = 0.2
+        result.timings["request"] = 0.1
+        h.append(result)
+        data = h.snapshot()
+        self.assertEqual(["web"], data["targets"])
+        self.assertEqual(["total", "request"], data["phases"])
+        self.assertEqual([0, 1], data["phase"].tolist())
+        self.assertEqual(2, h.count)
+
+    def test_phase_outcome(self):
+        h = main.ProbeHistory(10)
+        main.CONFIG_FILE = "./tests/config-tests.yaml"
+        for _ in range(3):
+            h.append(main.TCPProbe("tcp", {"ADDRESS": "127.0.0.1", "PORT": 3000}).run())
+        report = main.slo_report(h, main.slo_config({}))
+        self.assertEqual(1, report["targets"]["tcp"]["dns"]["availability"])
+        self.assertEqual(0, report["targets"]["tcp"]["connect"]["availability"])
+        self.assertEqual(0, report["targets"]["tcp"]["total"]["availability"])
+
+    def test_ring_buffer(self):
+        h = main.ProbeHistory(4)
+        h.extend(["a"] * 3, ["total"] * 3, [1, 2, 3], [True] * 3, [0.1] * 3)
+        h.extend(["b"] * 6, ["total"] * 6, [4, 5, 6, 7, 8, 9], [False] * 6, [0.1] * 6)
+        data = h.snapshot()
+        self.assertEqual(9, h.count)
+        self.assertEqual([6, 7, 8, 9], sorted(data["timestamp"].tolist()))
+        self.assertEqual([1, 1, 1, 1], data["target"].tolist())
+
+    def test_snapshot_since(self):
+        h = main.ProbeHistory(5)
+        # out of order timestamps, as probes finishing in different order
+        h.extend(["a"] * 4, ["total"] * 4, [1, 3, 2, 4], [True] * 4, [0.1] * 4)
+        self.assertEqual([3, 2, 4], h.snapshot(since=2).get("timestamp").tolist())
+        h.extend(["a"] * 3, ["total"] * 3, [6, 5, 7], [True] * 3, [0.1] * 3)
+        self.assertEqual([2, 4, 6, 5, 7], h.snapshot().get("timestamp").tolist())
+        self.assertEqual([6, 5, 7], h.snapshot(since=5).get("timestamp").tolist())
+        self.assertEqual([4, 6, 5, 7], h.snapshot(since=4).get("timestamp").tolist())
+        self.assertEqual([], h.snapshot(since=8).get("timestamp").tolist())
+
+
+class TestSLO(unittest.TestCase):
+    def setUp(self):
+        self.slo = main.slo_config({"SLO": {"OBJECTIVE": 0.99}})
+        self.history = main.ProbeHistory(1000)
+        # web: 100 probes in the last 100s, 10 failed
+        self.history.extend(["web"] * 100, ["total"] * 100, np.arange(900, 1000), np.arange(100) % 10 != 0,
+                            np.linspace(0.01, 1, 100))
+        # ns: 50 ok probes, old ones
+        self.history.extend(["ns"] * 50, ["query"] * 50, np.arange(50), [True] * 50, [0.05] * 50)
+
+    def test_slo_config(self):
+        self.assertEqual(0.99, self.slo["OBJECTIVE"])
+        self.assertEqual(main.SLO_DEFAULTS["WINDOW"], self.slo["WINDOW"])
+
+    def test_slo_config_invalid(self):
+        for slo in [{"OBJECTIVE": 1}, {"OBJECTIVE": 0}, {"OBJECTIVE": 99.9}, {"PERCENTILES": [50, 101]},
+                    {"PERCENTILES": [-1]}]:
+            self.assertRaises(main.InvalidSLOConfig, main.slo_config, {"SLO": slo})
+
+    def test_slo_config_invalid_burn_rate_alerts(self):
+        for rules in [[], [{"LONG_WINDOW": 3600, "BURN_RATE": 10}],
+                      [{"LONG_WINDOW": 3600, "SHORT_WINDOW": 300, "BURN_RATE": 0}],
+                      [{"LONG_WINDOW": 3600, "SHORT_WINDOW": "5m", "BURN_RATE": 10}],
+                      [{"LONG_WINDOW": 300, "SHORT_WINDOW": 3600, "BURN_RATE": 10}]]:
+            self.assertRaises(main.InvalidSLOConfig, main.slo_config, {"SLO": {"BURN_RATE_ALERTS": rules}})
+
+    def test_report(self):
+        report = main.slo_report(self.history, self.slo, now=1000)
+        web = report["targets"]["web"]["total"]
+        self.assertEqual(100, web["count"])
+        self.assertAlmostEqual(0.9, web["availability"])
+        self.assertAlmostEqual(10, web["burn_rate"])
+        self.assertAlmostEqual(-9, web["error_budget_remaining"])
+        ok_latency = np.linspace(0.01, 1, 100)[np.arange(100) % 10 != 0]
+        expected = np.percentile(ok_latency, [50, 90, 99], method="inverted_cdf")
+        np.testing.assert_allclose(expected, web["latency"], rtol=main.LATENCY_GROWTH - 1)
+        self.assertEqual(50, report["targets"]["ns"]["query"]["count"])
+        self.assertEqual(0, report["oldest"])
+        self.assertEqual(1000, report["covered"])
+        self.assertFalse(report["truncated"])
+
+    def test_report_truncated(self):
+        h = main.ProbeHistory(10)
+        h.extend(["web"] * 20, ["total"] * 20, np.arange(20), [True] * 20, [0.1] * 20)
+        with self.assertLogs(main.log, "WARNING"):
+            report = main.slo_report(h, self.slo, now=20, window=100)
+        self.assertTrue(report["truncated"])
+        self.assertEqual(10, report["oldest"])
+        self.assertEqual(10, report["covered"])
+        self.assertIn("history truncated", main.format_slo_report(report))
+        self.assertFalse(main.slo_report(h, self.slo, now=20, window=5)["truncated"])
+
+    def test_report_window(self):
+        report = main.slo_report(self.history, self.slo, now=1000, window=10)
+        self.assertEqual(["web"], list(report["targets"]))
+        self.assertEqual(10, report["targets"]["web"]["total"]["count"])
+        self.assertIn("web", main.format_slo_report(report))
+
+    def test_latency_percentiles_empty(self):
+        histogram = np.zeros((2, main.LATENCY_BUCKETS), dtype=np.int64)
+        histogram[0, 10] = 1
+        result = main.latency_percentiles(histogram, [50])
+        self.assertAlmostEqual(main.LATENCY_MIN * main.LATENCY_GROWTH ** 10, result[0, 0])
+        self.assertTrue(np.isnan(result[1, 0]))
+
+    def test_burn_rates(self):
+        targets, rates, samples, covered = main.burn_rates(self.history, 0.99, [10, 100, 200], now=1000)
+        web = rates[targets.index("web")]
+        self.assertAlmostEqual(10, web[0])
+        self.assertAlmostEqual(10, web[1])
+        self.assertEqual([10, 100, 100], samples[targets.index("web")].tolist())
+        # web rows start at 900
+        self.assertEqual([10, 100, 100], covered[targets.index("web")].tolist())
+        # ns has no "total" rows
+        self.assertTrue(np.isnan(rates[targets.index("ns")]).all())
+
+    def test_burn_rate_alert(self):
+        slo = dict(self.slo, BURN_RATE_ALERTS=[{"LONG_WINDOW": 100, "SHORT_WINDOW": 10, "BURN_RATE": 5}])
+        self.assertTrue(main.burn_rate_alert(self.history, "web", slo, now=1000))
+        # short window without errors
+        self.assertFalse(main.burn_rate_alert(self.history, "web", slo, now=1005))
+        self.assertFalse(main.burn_rate_alert(self.history, "ns", slo, now=1000))
+        self.assertFalse(main.burn_rate_alert(self.history, "unknown", slo, now=1000))
+
+    def test_burn_rate_alert_not_enough_data(self):
+        slo = dict(self.slo, BURN_RATE_ALERTS=[{"LONG_WINDOW": 100, "SHORT_WINDOW": 10, "BURN_RATE": 5}])
+        # long window 100s covered but only 100 probes
+        self.assertFalse(main.burn_rate_alert(self.history, "web", dict(slo, MIN_SAMPLES=101), now=1000))
+        # 100 probes in the last 100s, but the window is 1000s
+        slo["BURN_RATE_ALERTS"][0]["LONG_WINDOW"] = 1000
+        self.assertFalse(main.burn_rate_alert(self.history, "web", slo, now=1000))
+        self.assertTrue(main.burn_rate_alert(self.history, "web", dict(slo, MIN_COVERAGE=0.1), now=1000))
+
+    def test_single_failure_after_start(self):
+        h = main.ProbeHistory(10)
+        h.extend(["web"], ["total"], [1000], [False], [0.1])
+        self.assertFalse(main.burn_rate_alert(h, "web", main.slo_config({}), now=1000))
+
+    def test_slo_config_invalid_min_data(self):
+        for slo in [{"MIN_SAMPLES": 0}, {"MIN_SAMPLES": 1.5}, {"MIN_COVERAGE": 2}]:
+            self.assertRaises(main.InvalidSLOConfig, main.slo_config, {"SLO": slo})
+
+
+class TestBurnRateService(unittest.TestCase):
+    def tearDown(self):
+        main.PROBE_FAILED.clear()
+
+    @mock.patch.object(main, "HISTORY", main.ProbeHistory(100))
+    @mock.patch('main.notify')
+    @mock.patch('main.http_connect')
+    def test_http_burn_rate(self, mock_http_connect, mock_notify):
+        main.CONFIG_FILE = "./tests/config-tests-slo.yaml"
+        mock_http_connect.side_effect = ["CLOUDWALK FALHOU", "CLOUDWALK FALHOU", "CLOUDWALK TESTE"]
+        scan = main.Tests()
+        type(scan)._RUNNING = mock.PropertyMock(side_effect=[True, True, True, False])
+        self.assertIsNone(scan.test_http())
+        mock_notify.assert_called_once_with("HTTP Error - error budget burn rate too high")
+        self.assertTrue(main.PROBE_FAILED["HTTP"])
+        # total and request phase rows of each probe
+        self.assertEqual(6, main.HISTORY.count)
+
+
+    @mock.patch.object(main, "HISTORY", main.ProbeHistory(100))
+    @mock.patch('main.burn_rate_alert')
+    @mock.patch('main.notify')
+    @mock.patch('main.http_connect')
+    def test_http_burn_rate_error(self, mock_http_connect, mock_notify, mock_burn_rate_alert):
+        main.CONFIG_FILE = "./tests/config-tests-slo.yaml"
+        mock_http_connect.return_value = "CLOUDWALK TESTE"
+        mock_burn_rate_alert.side_effect = ValueError
+        scan = main.Tests()
+        type(scan)._RUNNING = mock.PropertyMock(side_effect=[True, False])
+        self.assertIsNone(scan.test_http())
+        self.assertTrue(main.PROBE_FAILED["HTTP"])
+
+
+class TestParseArgs(unittest.TestCase):
+    def test_default(self):
+        self.assertIsNone(main.parse_args([]).command)
+
+    def test_slo(self):
+        arguments = main.parse_args(["slo", "--window", "3600"])
+        self.assertEqual("slo", arguments.command)
+        self.assertEqual(3600, arguments.window)